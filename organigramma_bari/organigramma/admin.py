@@ -1,18 +1,58 @@
 import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
 from django.http import HttpResponse
 from django.urls import path
 from django.contrib import admin
 from django.contrib.admin import SimpleListFilter
 from django.db import models
-from django.db.models import Q
+from django.db.models import BooleanField, Case, Value, When
 from django.utils.html import format_html
 from django.utils import timezone  # <-- AGGIUNTO
 
 from .models import (
-    Qualifica, Responsabile, Struttura, Livello, StrutturaResponsabile
+    Qualifica, Responsabile, Struttura, Livello, StrutturaResponsabile, active_q
 )
 
 
+BOLD = Font(bold=True)
+
+# Colonne degli export Excel: EXPORT_FIELDS segue l'ordine di EXPORT_HEADERS.
+# Lette con values_list(): tuple piatte, nessuna istanza di modello per riga.
+EXPORT_HEADERS = (
+    "ID", "Nome", "Codice", "Livello", "Data Inizio", "Data Fine",
+    "Resp. Nome", "Resp. Cognome", "Qualifica",
+)
+EXPORT_FIELDS = (
+    'id', 'nome', 'codice', 'livello__nome', 'data_inizio', 'data_fine',
+    'responsabile__nome', 'responsabile__cognome', 'responsabile__qualifica__titolo',
+)
+
+
+def _iter_struttura_rows(qs):
+    """Righe dell'export in streaming; colonne del responsabile NULL → "Non Assegnato"."""
+    for row in qs.values_list(*EXPORT_FIELDS).iterator(chunk_size=2000):
+        yield row[:6] + tuple(v if v is not None else "Non Assegnato" for v in row[6:])
+
+
+def _export_excel_response(qs, filename):
+    # write_only: le righe vengono serializzate man mano, memoria ~costante
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet('Strutture')
+    header_cells = [WriteOnlyCell(ws, value=h) for h in EXPORT_HEADERS]
+    for cell in header_cells:
+        cell.font = BOLD
+    ws.append(header_cells)
+
+    for row in _iter_struttura_rows(qs):
+        ws.append(row)
+
+    resp = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    resp['Content-Disposition'] = f'attachment; filename={filename}'
+    wb.save(resp)
+    return resp
+
+
 # -------------------------
 # Inline storico assegnazioni
 # -------------------------
@@ -22,6 +62,9 @@ class StrutturaResponsabileInline(admin.TabularInline):
     fields = ('responsabile', 'data_inizio', 'data_fine')
     autocomplete_fields = ('responsabile',)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('responsabile__qualifica')
+
 
 # -------------------------
 # Filtri custom
@@ -34,13 +77,11 @@ class AttivaOggiFilter(SimpleListFilter):
         return (("yes", "Sì"), ("no", "No"))
 
     def queryset(self, request, qs):
-        today = timezone.now().date()  # usa l'import aggiunto
-        active = Q(data_inizio__lte=today) & (Q(data_fine__isnull=True) | Q(data_fine__gte=today))
-        if self.value() == "yes":
-            return qs.filter(active)
-        if self.value() == "no":
-            return qs.exclude(active)
-        return qs
+        value = self.value()
+        if value not in ("yes", "no"):
+            return qs
+        active = active_q(timezone.localdate())
+        return qs.filter(active) if value == "yes" else qs.exclude(active)
 
 
 # -------------------------
@@ -58,7 +99,8 @@ class StrutturaAdmin(admin.ModelAdmin):
         'nome', 'codice', 'responsabile__nome', 'responsabile__cognome',
         'responsabile__qualifica__titolo'
     )
-    ordering = ('codice',)
+    ordering = ('codice_sort',)
+    list_select_related = ('livello', 'responsabile__qualifica', 'struttura_padre__livello')
     autocomplete_fields = ('livello', 'responsabile', 'struttura_padre')
     readonly_fields = ('codice',)
     inlines = [StrutturaResponsabileInline]
@@ -77,79 +119,36 @@ class StrutturaAdmin(admin.ModelAdmin):
         }),
     )
 
+    def get_queryset(self, request):
+        # i join servono anche fuori dalla changelist (change view, action)
+        return super().get_queryset(request).select_related(*self.list_select_related)
+
     def attiva_oggi(self, obj):
         return obj.is_active()
     attiva_oggi.boolean = True              # <-- icona boolean nativa (✓/✗)
     attiva_oggi.short_description = "Attiva oggi"
 
     def save_model(self, request, obj, form, change):
-        # responsabile precedente (se esiste)
-        prev_resp_id = None
-        if change:
-            prev_resp_id = Struttura.objects.filter(pk=obj.pk).values_list('responsabile_id', flat=True).first()
+        # responsabile precedente (se esiste): il form lo ha già caricato nei dati iniziali
+        prev_resp_id = form.initial.get('responsabile') if change else None
 
         super().save_model(request, obj, form, change)
 
         # sincronizza storico solo se creazione o cambio FK
         if not change or (prev_resp_id != obj.responsabile_id):
-            obj.sync_assignment_from_fk(effective_date=timezone.now().date())
+            obj.sync_assignment_from_fk(effective_date=timezone.localdate(), prev_resp_id=prev_resp_id)
 
     # ----- ACTION: Esporta selezionate in Excel -----
     actions = ["export_selected_excel"]
 
     def export_selected_excel(self, request, queryset):
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = 'Strutture'
-        headers = ["ID", "Nome", "Codice", "Livello", "Data Inizio", "Data Fine",
-                   "Resp. Nome", "Resp. Cognome", "Qualifica"]
-        ws.append(headers)
-        for cell in ws[1]:
-            cell.font = openpyxl.styles.Font(bold=True)
-
-        qs = queryset.select_related('livello', 'responsabile', 'responsabile__qualifica')
-        for s in qs:
-            r = s.responsabile
-            qual = r.qualifica.titolo if r and r.qualifica else "Non Assegnato"
-            ws.append([
-                s.id, s.nome, s.codice, str(s.livello), s.data_inizio, s.data_fine,
-                r.nome if r else "Non Assegnato",
-                r.cognome if r else "Non Assegnato",
-                qual
-            ])
-
-        resp = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        resp['Content-Disposition'] = 'attachment; filename=strutture_selezionate.xlsx'
-        wb.save(resp)
-        return resp
+        return _export_excel_response(queryset, 'strutture_selezionate.xlsx')
 
     export_selected_excel.short_description = "Esporta selezionate in Excel"
 
     # ----- (opzionale) vista globale export -----
     def export_excel_view(self, request):
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = 'Strutture'
-        headers = ["ID", "Nome", "Codice", "Livello", "Data Inizio", "Data Fine",
-                   "Resp. Nome", "Resp. Cognome", "Qualifica"]
-        ws.append(headers)
-        for cell in ws[1]:
-            cell.font = openpyxl.styles.Font(bold=True)
-
-        for s in Struttura.objects.select_related('livello', 'responsabile', 'responsabile__qualifica'):
-            r = s.responsabile
-            qual = r.qualifica.titolo if r and r.qualifica else "Non Assegnato"
-            ws.append([
-                s.id, s.nome, s.codice, str(s.livello), s.data_inizio, s.data_fine,
-                r.nome if r else "Non Assegnato",
-                r.cognome if r else "Non Assegnato",
-                qual
-            ])
-
-        resp = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        resp['Content-Disposition'] = 'attachment; filename=strutture.xlsx'
-        wb.save(resp)
-        return resp
+        return _export_excel_response(Struttura.objects.all(), 'strutture.xlsx')
 
     def get_urls(self):
         urls = super().get_urls()
@@ -171,16 +170,33 @@ class QualificaAdmin(admin.ModelAdmin):
 
 @admin.register(Responsabile)
 class ResponsabileAdmin(admin.ModelAdmin):
-    list_display = ('nome', 'cognome', 'qualifica', 'in_carica', 'data_inizio', 'data_fine')
+    list_display = ('nome', 'cognome', 'qualifica', 'in_carica', 'data_inizio', 'data_fine', 'attiva_oggi')
     list_filter = ('qualifica', 'in_carica', 'data_inizio', 'data_fine')
+    list_select_related = ('qualifica',)
     search_fields = ('nome', 'cognome', 'qualifica__titolo')
 
+    def get_queryset(self, request):
+        # stato "attivo oggi" calcolato in SQL una volta sola, non per riga in Python
+        return super().get_queryset(request).annotate(
+            _attiva_oggi=Case(
+                When(active_q(timezone.localdate()), then=Value(True)),
+                default=Value(False),
+                output_field=BooleanField(),
+            )
+        )
+
+    def attiva_oggi(self, obj):
+        return obj._attiva_oggi
+    attiva_oggi.boolean = True
+    attiva_oggi.admin_order_field = '_attiva_oggi'
+    attiva_oggi.short_description = "Attiva oggi"
+
 
 @admin.register(Livello)
 class LivelloAdmin(admin.ModelAdmin):
     list_display = ('nome', 'ordine', 'can_be_root')
     list_editable = ('ordine', 'can_be_root')
-    filter_horizontal = ('allowed_parents',)
+    autocomplete_fields = ('allowed_parents',)
     search_fields = ('nome', 'descrizione')
     ordering = ('ordine', 'nome')
 
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class OrganigrammaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'organigramma'
+
+    def ready(self):
+        from . import signals  # noqa: F401  (registra i receiver)
@@ -0,0 +1,43 @@
+"""
+Backend di autenticazione con i permessi in cache.
+
+ModelBackend ricalcola i permessi (join utente→gruppi→permessi) a ogni
+richiesta: la cache di Django (_perm_cache) vive solo sull'oggetto user della
+richiesta. Qui l'insieme dei permessi resta nella cache condivisa; la chiave
+contiene una versione globale rinnovata dai segnali in signals.py a ogni
+modifica di utenti, gruppi o assegnazioni (stesso schema di tree_cache.py).
+"""
+import time
+
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+PERMS_CACHE_TIMEOUT = 300
+_VERSION_KEY = 'organigramma:perms:version'
+
+
+def perms_version():
+    version = cache.get(_VERSION_KEY)
+    if version is None:
+        version = bump_perms_version()
+    return version
+
+
+def bump_perms_version():
+    version = str(time.time_ns())
+    cache.set(_VERSION_KEY, version, None)
+    return version
+
+
+class CachedPermissionBackend(ModelBackend):
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        if not hasattr(user_obj, '_perm_cache'):
+            key = f'organigramma:perms:{perms_version()}:{user_obj.pk}'
+            user_obj._perm_cache = cache.get_or_set(
+                key, lambda: super(CachedPermissionBackend, self).get_all_permissions(user_obj),
+                PERMS_CACHE_TIMEOUT,
+            )
+        return user_obj._perm_cache
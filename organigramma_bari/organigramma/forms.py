@@ -78,7 +78,8 @@ class StrutturaForm(ErrorStylingMixin, forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         # data di riferimento per filtrare le scelte (passata dalla view)
-        self.on_date = kwargs.pop('on_date', None) or timezone.now().date()
+        today = timezone.localdate()
+        self.on_date = kwargs.pop('on_date', None) or today
         super().__init__(*args, **kwargs)
 
         # Filtra scelte in base all'attività
@@ -86,15 +87,15 @@ class StrutturaForm(ErrorStylingMixin, forms.ModelForm):
             Responsabile.objects.all(), self.on_date
         ).order_by('cognome', 'nome')
 
-        padre_qs = _active_qs(Struttura.objects.all(), self.on_date)
+        padre_qs = _active_qs(Struttura.objects.all(), self.on_date).with_livello()
         # Esclude se stessa dall'elenco padri (utile in update)
         if self.instance and self.instance.pk:
             padre_qs = padre_qs.exclude(pk=self.instance.pk)
-        self.fields['struttura_padre'].queryset = padre_qs.order_by('codice')
+        self.fields['struttura_padre'].queryset = padre_qs.order_by('codice_sort')
 
         # Default comodo in creazione
         if not self.instance.pk and not self.initial.get('data_inizio'):
-            self.initial['data_inizio'] = timezone.now().date()
+            self.initial['data_inizio'] = today
 
     def clean(self):
         cleaned = super().clean()
@@ -160,10 +161,13 @@ from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User, Group
 
+# Gruppi che rappresentano i ruoli applicativi (vedi setup_roles)
+RUOLI = ['Base', 'Avanzati', 'Amministratori']
+
 class CreateUserForm(UserCreationForm):
     email = forms.EmailField(required=False)
     gruppo = forms.ModelChoiceField(
-        queryset=Group.objects.filter(name__in=['Base','Avanzati','Amministratori']),
+        queryset=Group.objects.filter(name__in=RUOLI).only('id', 'name'),
         required=True, empty_label=None, label="Ruolo"
     )
     is_superuser = forms.BooleanField(required=False, label="Amministratore (superuser)")
@@ -181,8 +185,7 @@ class CreateUserForm(UserCreationForm):
             user.save()
             # assegna gruppo
             g = self.cleaned_data['gruppo']
-            user.groups.clear()
-            user.groups.add(g)
+            user.groups.set([g])
         return user
     
     def __init__(self, *args, **kwargs):
@@ -199,7 +202,7 @@ from django.contrib.auth.models import User, Group
 
 class UserUpdateForm(forms.ModelForm):
     gruppo = forms.ModelChoiceField(
-        queryset=Group.objects.filter(name__in=['Base','Avanzati','Amministratori']),
+        queryset=Group.objects.filter(name__in=RUOLI).only('id', 'name'),
         required=True, empty_label=None, label="Ruolo"
     )
     is_superuser = forms.BooleanField(required=False, label="Amministratore (superuser)")
@@ -219,13 +222,13 @@ class UserUpdateForm(forms.ModelForm):
         self.fields['is_active'].widget.attrs.update({'class': 'form-check-input'})
 
         if self.instance and self.instance.pk:
-            g = self.instance.groups.filter(name__in=['Base','Avanzati','Amministratori']).first()
+            # groups.all() usa la cache del prefetch_related('groups') della view
+            g = next((g for g in self.instance.groups.all() if g.name in RUOLI), None)
             if g:
                 self.initial['gruppo'] = g.pk
 
     def save(self, commit=True):
         user = super().save(commit=commit)
         g = self.cleaned_data['gruppo']
-        user.groups.clear()
-        user.groups.add(g)
+        user.groups.set([g])
         return user
@@ -2,24 +2,36 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import Group, Permission
 from django.contrib.contenttypes.models import ContentType
+from organigramma.backends import bump_perms_version
+from organigramma.forms import RUOLI
 from organigramma.models import Struttura
 
+# ruoli che ottengono il permesso del simulatore (i superuser lo ignorano comunque)
+RUOLI_SIMULATORE = ['Avanzati', 'Amministratori']
+
+
 class Command(BaseCommand):
     help = "Crea gruppi Base/Avanzati/Amministratori e il permesso 'view_simulatore'"
 
     def handle(self, *args, **opts):
         ct = ContentType.objects.get_for_model(Struttura)
-        perm, _ = Permission.objects.get_or_create(
-            codename='view_simulatore',
-            defaults={'name': 'Può accedere al simulatore', 'content_type': ct},
-            content_type=ct,
+
+        # Idempotente: ignore_conflicts salta le righe già presenti (vincoli unique)
+        Permission.objects.bulk_create(
+            [Permission(codename='view_simulatore', name='Può accedere al simulatore', content_type=ct)],
+            ignore_conflicts=True,
         )
+        perm = Permission.objects.get(codename='view_simulatore', content_type=ct)
 
-        base, _ = Group.objects.get_or_create(name='Base')
-        avanzati, _ = Group.objects.get_or_create(name='Avanzati')
-        admin_g, _ = Group.objects.get_or_create(name='Amministratori')
+        Group.objects.bulk_create([Group(name=n) for n in RUOLI], ignore_conflicts=True)
+        groups = dict(Group.objects.filter(name__in=RUOLI_SIMULATORE).values_list('name', 'id'))
 
-        avanzati.permissions.add(perm)
-        admin_g.permissions.add(perm)  # opzionale; i superuser lo ignorano comunque
+        through = Group.permissions.through
+        through.objects.bulk_create(
+            [through(group_id=groups[n], permission_id=perm.id) for n in RUOLI_SIMULATORE],
+            ignore_conflicts=True,
+        )
+        # i bulk_create non inviano segnali: invalido a mano i permessi in cache
+        bump_perms_version()
 
         self.stdout.write(self.style.SUCCESS("Ruoli/permessi creati."))
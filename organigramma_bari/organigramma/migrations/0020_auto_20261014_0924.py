@@ -0,0 +1,25 @@
+# Generated by Django 3.2.18 on 2026-10-14 07:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organigramma', '0019_auto_20250814_1143'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='responsabile',
+            index=models.Index(fields=['data_inizio', 'data_fine'], name='responsabile_attiva_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='responsabile',
+            index=models.Index(condition=models.Q(('data_fine__isnull', True)), fields=['data_inizio'], name='responsabile_active_null_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='struttura',
+            index=models.Index(condition=models.Q(('data_fine__isnull', True)), fields=['data_inizio'], name='struttura_active_null_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.2.18 on 2026-10-14 07:26
+
+from django.db import migrations, models
+import django.db.models.expressions
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organigramma', '0020_auto_20261014_0924'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='responsabile',
+            constraint=models.CheckConstraint(check=models.Q(('data_fine__isnull', True), ('data_fine__gte', django.db.models.expressions.F('data_inizio')), _connector='OR'), name='responsabile_fine_gte_inizio'),
+        ),
+        migrations.AddConstraint(
+            model_name='struttura',
+            constraint=models.CheckConstraint(check=models.Q(('data_fine__isnull', True), ('data_fine__gte', django.db.models.expressions.F('data_inizio')), _connector='OR'), name='struttura_fine_gte_inizio'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.18 on 2026-10-14 07:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organigramma', '0021_auto_20261014_0926'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='struttura',
+            index=models.Index(condition=models.Q(('data_fine__isnull', False)), fields=['data_fine'], name='struttura_closed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='strutturaresponsabile',
+            index=models.Index(condition=models.Q(('data_fine__isnull', True)), fields=['struttura', 'data_inizio'], name='assegn_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='strutturaresponsabile',
+            index=models.Index(condition=models.Q(('data_fine__isnull', False)), fields=['struttura', 'data_fine'], name='assegn_closed_idx'),
+        ),
+    ]
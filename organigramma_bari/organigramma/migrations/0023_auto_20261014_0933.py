@@ -0,0 +1,44 @@
+# Generated by Django 3.2.18 on 2026-10-14 07:33
+
+from django.db import migrations, models
+
+
+def backfill_codice_sort(apps, schema_editor):
+    # copia locale della logica di models.codice_sort_key: le migrazioni non
+    # devono dipendere dal codice corrente dei modelli
+    Struttura = apps.get_model('organigramma', 'Struttura')
+
+    def sort_key(codice):
+        if not codice:
+            return ''
+        return '.'.join(f'{int(seg):06d}' if seg.isdigit() else seg for seg in codice.split('.'))
+
+    batch = []
+    for s in Struttura.objects.only('id', 'codice').iterator(chunk_size=2000):
+        s.codice_sort = sort_key(s.codice)
+        batch.append(s)
+        if len(batch) >= 1000:
+            Struttura.objects.bulk_update(batch, ['codice_sort'])
+            batch = []
+    if batch:
+        Struttura.objects.bulk_update(batch, ['codice_sort'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organigramma', '0022_auto_20261014_0929'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='struttura',
+            options={'ordering': ['codice_sort'], 'verbose_name': 'Struttura', 'verbose_name_plural': 'Strutture'},
+        ),
+        migrations.AddField(
+            model_name='struttura',
+            name='codice_sort',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=200),
+        ),
+        migrations.RunPython(backfill_codice_sort, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations
+
+# Vincolo di non sovrapposizione dei periodi per struttura, applicato dal DB.
+# Solo PostgreSQL (EXCLUDE USING gist + btree_gist); su SQLite resta il
+# controllo applicativo di StrutturaResponsabile.clean().
+# daterange(inizio, NULL, '[]') = periodo aperto: niente colonna "periodo" da mantenere.
+
+TABLE = 'organigramma_strutturaresponsabile'
+CONSTRAINT = 'no_overlap_periodo'
+
+
+def add_exclusion(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    schema_editor.execute(
+        f'ALTER TABLE {TABLE} ADD CONSTRAINT {CONSTRAINT} EXCLUDE USING gist '
+        f"(struttura_id WITH =, daterange(data_inizio, data_fine, '[]') WITH &&)"
+    )
+
+
+def drop_exclusion(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'ALTER TABLE {TABLE} DROP CONSTRAINT IF EXISTS {CONSTRAINT}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organigramma', '0023_auto_20261014_0933'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_exclusion, drop_exclusion),
+    ]
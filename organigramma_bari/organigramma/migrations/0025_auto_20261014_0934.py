@@ -0,0 +1,52 @@
+# Generated by Django 3.2.18 on 2026-10-14 07:34
+
+from django.db import migrations, models
+
+
+def backfill_path(apps, schema_editor):
+    # una lettura di (id, padre) e calcolo in memoria: nessuna query per nodo
+    Struttura = apps.get_model('organigramma', 'Struttura')
+    parents = dict(Struttura.objects.values_list('id', 'struttura_padre_id'))
+    computed = {}
+
+    def path_of(pk):
+        chain = []
+        while pk is not None and pk not in computed and pk not in chain:
+            chain.append(pk)
+            pk = parents.get(pk)
+        base = computed.get(pk)  # None se root raggiunta (o ciclo nei dati)
+        for node in reversed(chain):
+            base = (f'{base[0]}/{node}', base[1] + 1) if base else (str(node), 0)
+            computed[node] = base
+        return computed[chain[0]] if chain else computed[pk]
+
+    batch = []
+    for s in Struttura.objects.only('id').iterator(chunk_size=2000):
+        s.path, s.depth = path_of(s.pk)
+        batch.append(s)
+        if len(batch) >= 1000:
+            Struttura.objects.bulk_update(batch, ['path', 'depth'])
+            batch = []
+    if batch:
+        Struttura.objects.bulk_update(batch, ['path', 'depth'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organigramma', '0024_strutturaresponsabile_no_overlap'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='struttura',
+            name='depth',
+            field=models.PositiveSmallIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='struttura',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=512),
+        ),
+        migrations.RunPython(backfill_path, migrations.RunPython.noop),
+    ]
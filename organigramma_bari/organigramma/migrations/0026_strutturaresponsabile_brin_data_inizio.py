@@ -0,0 +1,35 @@
+from django.db import migrations
+
+# Indice BRIN su data_inizio dello storico (righe inserite in ordine di data):
+# minuscolo e quasi gratis in scrittura per le scansioni per intervallo.
+# Solo PostgreSQL (BrinIndex di django.contrib.postgres richiede psycopg2):
+# sugli altri DB restano gli indici B-tree/parziali già presenti.
+
+TABLE = 'organigramma_strutturaresponsabile'
+INDEX = 'assegn_inizio_brin'
+
+
+def add_brin(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        f'CREATE INDEX IF NOT EXISTS {INDEX} ON {TABLE} '
+        f'USING brin (data_inizio) WITH (pages_per_range = 16)'
+    )
+
+
+def drop_brin(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organigramma', '0025_auto_20261014_0934'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_brin, drop_brin),
+    ]
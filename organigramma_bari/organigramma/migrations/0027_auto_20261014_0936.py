@@ -0,0 +1,103 @@
+# Generated by Django 3.2.18 on 2026-10-14 07:36
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def _sort_key(codice):
+    # come models.codice_sort_key
+    return '.'.join(f'{int(seg):06d}' if seg.isdigit() else seg for seg in codice.split('.'))
+
+
+def renumber_duplicate_codes(apps, schema_editor):
+    # La vecchia numerazione lessicografica ha lasciato codici ripetuti tra
+    # fratelli ("1.10" due volte): prima dei vincoli di unicità si tiene il più
+    # vecchio (id minore) e gli altri prendono il primo suffisso libero. Il
+    # sottoalbero di un nodo rinumerato ne segue il prefisso ("1.10.1" sotto il
+    # secondo 1.10 diventa "1.13.1"), per questo la visita parte dalle root.
+    Struttura = apps.get_model('organigramma', 'Struttura')
+    StrutturaCodeCounter = apps.get_model('organigramma', 'StrutturaCodeCounter')
+    old = {}
+    kids = defaultdict(list)
+    for pk, parent_id, codice in (Struttura.objects.order_by('id')
+                                  .values_list('id', 'struttura_padre_id', 'codice')):
+        old[pk] = codice
+        kids[parent_id].append(pk)
+    new = dict(old)
+    next_suffix = {}
+
+    def fix_siblings(parent_id, old_prefix, prefix):
+        group = kids[parent_id]
+        if old_prefix != prefix:
+            for pk in group:
+                if new[pk] and new[pk].startswith(old_prefix):
+                    new[pk] = prefix + new[pk][len(old_prefix):]
+        seen, dupes = set(), []
+        for pk in group:
+            if new[pk] is None:
+                continue
+            if new[pk] in seen:
+                dupes.append(pk)
+            else:
+                seen.add(new[pk])
+        n = max((int(c[len(prefix):]) for c in seen
+                 if c.startswith(prefix) and c[len(prefix):].isdigit()), default=0)
+        for pk in dupes:
+            n += 1
+            new[pk] = f'{prefix}{n}'
+        # contatore allineato al massimo in uso, come lo seminerebbe _next_code
+        next_suffix[parent_id or 0] = n + 1
+
+    def child_prefix(codes, pk):
+        return f'{codes[pk]}.' if codes[pk] else '.'
+
+    visited = set()
+    stack = [(None, '', '')]
+    while stack:
+        parent_id, old_prefix, prefix = stack.pop()
+        visited.add(parent_id)
+        fix_siblings(parent_id, old_prefix, prefix)
+        stack.extend((pk, child_prefix(old, pk), child_prefix(new, pk))
+                     for pk in kids[parent_id] if pk in kids and pk not in visited)
+    # nodi non raggiungibili dalle root (cicli nei dati): solo i duplicati tra fratelli
+    for parent_id in [p for p in kids if p not in visited]:
+        prefix = child_prefix(new, parent_id)
+        fix_siblings(parent_id, prefix, prefix)
+
+    for pk, codice in new.items():
+        if codice != old[pk]:
+            Struttura.objects.filter(pk=pk).update(codice=codice, codice_sort=_sort_key(codice))
+    StrutturaCodeCounter.objects.bulk_create(
+        [StrutturaCodeCounter(parent_id=key, next_suffix=n) for key, n in next_suffix.items()]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organigramma', '0026_strutturaresponsabile_brin_data_inizio'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StrutturaCodeCounter',
+            fields=[
+                ('parent_id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('next_suffix', models.PositiveIntegerField(default=1)),
+            ],
+            options={
+                'verbose_name': 'Contatore codici',
+                'verbose_name_plural': 'Contatori codici',
+            },
+        ),
+        migrations.RunPython(renumber_duplicate_codes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='struttura',
+            constraint=models.UniqueConstraint(fields=('struttura_padre', 'codice'), name='struttura_codice_unico_per_padre'),
+        ),
+        migrations.AddConstraint(
+            model_name='struttura',
+            constraint=models.UniqueConstraint(condition=models.Q(('struttura_padre__isnull', True)), fields=('codice',), name='struttura_codice_unico_root'),
+        ),
+    ]
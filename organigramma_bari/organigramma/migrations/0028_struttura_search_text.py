@@ -0,0 +1,59 @@
+# Generated by Django 3.2.18 on 2026-10-14 07:41
+
+from django.db import migrations, models
+
+# Indici trigram (pg_trgm) per le ricerche "contiene" degli elenchi: solo PostgreSQL.
+# Su Struttura la ricerca è `search_text LIKE '%term%'`; su Responsabile è
+# icontains, che Django traduce in UPPER(col::text) LIKE UPPER(...): l'indice
+# deve essere sulla stessa espressione.
+TRGM_INDEXES = (
+    ('struttura_search_trgm', 'organigramma_struttura', 'search_text'),
+    ('responsabile_nome_trgm', 'organigramma_responsabile', 'UPPER(nome::text)'),
+    ('responsabile_cognome_trgm', 'organigramma_responsabile', 'UPPER(cognome::text)'),
+)
+
+
+def backfill_search_text(apps, schema_editor):
+    Struttura = apps.get_model('organigramma', 'Struttura')
+    batch = []
+    for s in Struttura.objects.select_related('livello', 'responsabile').iterator(chunk_size=1000):
+        parts = [s.codice, s.nome]
+        if s.livello_id:
+            parts.append(s.livello.nome)
+        if s.responsabile_id:
+            parts += [s.responsabile.nome, s.responsabile.cognome]
+        s.search_text = ' '.join(p for p in parts if p).lower()
+        batch.append(s)
+    Struttura.objects.bulk_update(batch, ['search_text'], batch_size=1000)
+
+
+def add_trgm_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, expr in TRGM_INDEXES:
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin (({expr}) gin_trgm_ops)')
+
+
+def drop_trgm_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _table, _expr in TRGM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organigramma', '0027_auto_20261014_0936'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='struttura',
+            name='search_text',
+            field=models.CharField(default='', editable=False, max_length=500),
+        ),
+        migrations.RunPython(backfill_search_text, migrations.RunPython.noop),
+        migrations.RunPython(add_trgm_indexes, drop_trgm_indexes),
+    ]
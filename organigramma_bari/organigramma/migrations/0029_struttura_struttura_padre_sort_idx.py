@@ -0,0 +1,42 @@
+# Generated by Django 3.2.18 on 2026-10-14 07:45
+
+from django.db import migrations, models
+
+# Piano atteso per le root/figli ordinati (WHERE struttura_padre_id IS NULL / = %s
+# ORDER BY codice_sort):
+#   prima: Seq Scan (o Index Scan su struttura_padre) + Sort su codice_sort
+#   dopo:  Index Scan using struttura_padre_sort_idx, senza nodo Sort.
+# Il periodo (data_inizio, data_fine) e lo storico (struttura, data_inizio,
+# data_fine) hanno già i loro indici (0015/0020/0022).
+# Su tabelle grandi in PostgreSQL conviene crearlo a mano senza bloccare le scritture:
+#   CREATE INDEX CONCURRENTLY struttura_padre_sort_idx
+#       ON organigramma_struttura (struttura_padre_id, codice_sort);
+# e poi segnare questa migration come applicata, altrimenti AddIndex rifà il
+# CREATE INDEX e fallisce con "relation already exists". Prima va applicato
+# normalmente tutto fino alla 0028 (--fake salterebbe anche quelle pendenti):
+#   python manage.py migrate organigramma 0028
+#   python manage.py migrate organigramma 0029 --fake
+#   DROP INDEX CONCURRENTLY organigramm_struttu_2c2f36_idx;
+# (il --fake salta anche il RemoveIndex qui sotto).
+# L'indice semplice su struttura_padre (0015) è un prefisso del nuovo e doppia
+# quello che Django crea già per il FK: tre indici sulla stessa colonna da
+# aggiornare a ogni scrittura, quindi va tolto.
+# (AddIndexConcurrently richiede django.contrib.postgres/psycopg2, non usati qui.)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organigramma', '0028_struttura_search_text'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='struttura',
+            index=models.Index(fields=['struttura_padre', 'codice_sort'], name='struttura_padre_sort_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='struttura',
+            name='organigramm_struttu_2c2f36_idx',
+        ),
+    ]
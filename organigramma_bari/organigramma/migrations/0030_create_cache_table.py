@@ -0,0 +1,21 @@
+# Generated by Django 3.2.18 on 2026-10-14 10:12
+
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_cache_table(apps, schema_editor):
+    # tabella della DatabaseCache di default (settings.CACHES): così basta il
+    # migrate; se CACHES punta a un altro backend createcachetable non fa nulla
+    call_command('createcachetable', database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organigramma', '0029_struttura_struttura_padre_sort_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_table, migrations.RunPython.noop),
+    ]
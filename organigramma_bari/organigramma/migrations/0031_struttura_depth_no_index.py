@@ -0,0 +1,18 @@
+# Generated by Django 3.2.18 on 2026-10-14 08:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organigramma', '0030_create_cache_table'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='struttura',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+    ]
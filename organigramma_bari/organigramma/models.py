@@ -1,10 +1,42 @@
-from datetime import timedelta, date
-from django.db import models
-from django.db.models import Q
+import re
+from datetime import timedelta
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import (
+    DEFERRED, Case, Exists, F, IntegerField, Max, OuterRef, Prefetch, Q, Subquery,
+    Value, When,
+)
+from django.db.models.functions import Cast, Coalesce, Concat, Substr
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 
 
+def active_q(on_date, prefix=''):
+    """
+    Predicato "attivo alla data" condiviso da tutti i modelli con periodo
+    di validità (data_inizio/data_fine): estremi NULL = intervallo aperto.
+    prefix per applicarlo a una relazione (es. 'responsabile__').
+    """
+    return (
+        (Q(**{f'{prefix}data_inizio__isnull': True}) | Q(**{f'{prefix}data_inizio__lte': on_date})) &
+        (Q(**{f'{prefix}data_fine__isnull': True}) | Q(**{f'{prefix}data_fine__gte': on_date}))
+    )
+
+
+def codice_sort_key(codice):
+    """
+    Chiave ordinabile come stringa del codice gerarchico: ogni segmento numerico
+    è riempito a 6 cifre ("1.10" → "000001.000010"), così l'ordinamento del DB
+    (e il suo indice) coincide con quello naturale senza riordinare in Python.
+    """
+    if not codice:
+        return ''
+    return '.'.join(f'{int(seg):06d}' if seg.isdigit() else seg for seg in codice.split('.'))
+
+
+# sentinella per "argomento non passato" (None è un valore significativo)
+_UNSET = object()
+
+
 # =========================
 # Qualifica
 # =========================
@@ -63,10 +95,7 @@ class Livello(models.Model):
 
 class ResponsabileQuerySet(models.QuerySet):
     def active_on(self, on_date):
-        return self.filter(
-            Q(data_inizio__isnull=True) | Q(data_inizio__lte=on_date),
-            Q(data_fine__isnull=True)   | Q(data_fine__gte=on_date)
-        )
+        return self.filter(active_q(on_date))
 
 
 class Responsabile(models.Model):
@@ -84,13 +113,25 @@ class Responsabile(models.Model):
     class Meta:
         verbose_name = "Responsabile"
         verbose_name_plural = "Responsabili"
+        indexes = [
+            models.Index(fields=['data_inizio', 'data_fine'], name='responsabile_attiva_idx'),
+            # responsabili ancora in carica (data_fine aperta): il caso più frequente
+            models.Index(fields=['data_inizio'], condition=Q(data_fine__isnull=True),
+                         name='responsabile_active_null_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                check=Q(data_fine__isnull=True) | Q(data_fine__gte=F('data_inizio')),
+                name='responsabile_fine_gte_inizio',
+            ),
+        ]
 
     def __str__(self):
         q = f" - {self.qualifica.titolo}" if getattr(self, "qualifica", None) else ""
         return f"{self.nome} {self.cognome}{q}"
 
     def is_active(self, d=None):
-        d = d or timezone.now().date()
+        d = d or timezone.localdate()
         return ((self.data_inizio is None or self.data_inizio <= d) and
                 (self.data_fine   is None or self.data_fine   >= d))
 
@@ -105,10 +146,45 @@ class Responsabile(models.Model):
 
 class StrutturaQuerySet(models.QuerySet):
     def active_on(self, on_date):
-        return self.filter(
-            Q(data_inizio__isnull=True) | Q(data_inizio__lte=on_date),
-            Q(data_fine__isnull=True)   | Q(data_fine__gte=on_date)
+        return self.filter(active_q(on_date))
+
+    def with_livello(self):
+        """Per gli elenchi che mostrano str(struttura): evita una query sul livello per riga."""
+        return self.select_related('livello')
+
+    # colonne effettivamente lette dalle viste ad albero (to_dict + responsabile_on):
+    # restano fuori num_ode/num_eng, historical_parent, path/depth
+    TREE_FIELDS = (
+        'id', 'nome', 'codice', 'codice_sort', 'url', 'livello', 'struttura_padre',
+        'responsabile', 'data_inizio', 'data_fine',
+    )
+
+    def for_tree(self):
+        """Queryset "leggero" per il rendering dell'albero: solo TREE_FIELDS + livello in join."""
+        return self.only(*self.TREE_FIELDS).select_related('livello')
+
+    def with_responsabile_on_id(self, on_date):
+        """
+        Annota _resp_on_id = pk del responsabile che responsabile_on(on_date)
+        restituirebbe (stesse regole: assegnazione attiva più recente se il suo
+        responsabile è attivo, altrimenti il FK se attivo), calcolato in SQL.
+        Per gli export a tuple (values_list) senza istanze né prefetch.
+        """
+        storico = (StrutturaResponsabile.objects
+                       .filter(struttura=OuterRef('pk'))
+                       .active_on(on_date)
+                       .order_by('-data_inizio')
+                       .annotate(_r=Case(
+                           When(active_q(on_date, 'responsabile__'), then=F('responsabile_id')),
+                           default=None,
+                       ))
+                       .values('_r')[:1])
+        fk = Case(
+            When(Q(responsabile__isnull=False) & active_q(on_date, 'responsabile__'),
+                 then=F('responsabile_id')),
+            default=None,
         )
+        return self.annotate(_resp_on_id=Coalesce(Subquery(storico), fk))
 
 
 class Struttura(models.Model):
@@ -125,6 +201,16 @@ class Struttura(models.Model):
         'self', on_delete=models.CASCADE, null=True, blank=True, related_name="sottostrutture"
     )
     codice = models.CharField(max_length=50, editable=False, null=True)
+    # chiave di ordinamento naturale del codice ("1.2" < "1.10"), vedi codice_sort_key
+    codice_sort = models.CharField(max_length=200, editable=False, db_index=True, default='')
+    # cammino materializzato: id dalla root separati da '/' (es. "1/4/9"), depth 0 = root.
+    # Mantenuti da save() (anche sui discendenti): non vanno scritti a mano.
+    path = models.CharField(max_length=512, editable=False, db_index=True, default='')
+    depth = models.PositiveSmallIntegerField(editable=False, default=0)
+    # testo di ricerca denormalizzato (codice, nome, livello, responsabile) in minuscolo:
+    # la ricerca interroga una colonna sola, senza join. Aggiornato da save() e dai
+    # segnali su Livello/Responsabile (vedi refresh_search_text)
+    search_text = models.CharField(max_length=500, editable=False, default='')
     data_inizio = models.DateField(default=timezone.now)
     data_fine = models.DateField(null=True, blank=True)
     historical_parent = models.ForeignKey(
@@ -147,14 +233,32 @@ class Struttura(models.Model):
     class Meta:
         verbose_name = "Struttura"
         verbose_name_plural = "Strutture"
-        ordering = ["codice"]
+        ordering = ["codice_sort"]
         indexes = [
-            models.Index(fields=['struttura_padre']),
+            # figli di un padre (o root) già in ordine di codice: niente sort in memoria.
+            # Copre anche i filtri sul solo struttura_padre (prefisso), come l'indice del FK
+            models.Index(fields=['struttura_padre', 'codice_sort'], name='struttura_padre_sort_idx'),
             models.Index(fields=['data_inizio', 'data_fine']),
+            models.Index(fields=['data_inizio'], condition=Q(data_fine__isnull=True),
+                         name='struttura_active_null_idx'),
+            models.Index(fields=['data_fine'], condition=Q(data_fine__isnull=False),
+                         name='struttura_closed_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                check=Q(data_fine__isnull=True) | Q(data_fine__gte=F('data_inizio')),
+                name='struttura_fine_gte_inizio',
+            ),
+            # codici univoci tra fratelli (per le root serve il vincolo parziale: NULL ≠ NULL)
+            models.UniqueConstraint(fields=['struttura_padre', 'codice'],
+                                    name='struttura_codice_unico_per_padre'),
+            models.UniqueConstraint(fields=['codice'], condition=Q(struttura_padre__isnull=True),
+                                    name='struttura_codice_unico_root'),
         ]
 
     def __str__(self):
-        # Evita eccezioni se il livello non è impostato o è stato cancellato
+        # Evita eccezioni se il livello non è impostato o è stato cancellato.
+        # Negli elenchi usare with_livello(): altrimenti qui parte una query per riga.
         lvl_name = ""
         try:
             if self.livello_id:
@@ -166,17 +270,67 @@ class Struttura(models.Model):
     # ---- Stato attività
 
     def is_active(self, d=None):
-        d = d or timezone.now().date()
+        d = d or timezone.localdate()
         return ((self.data_inizio is None or self.data_inizio <= d) and
                 (self.data_fine   is None or self.data_fine   >= d))
 
     def active_children(self, on_date):
-        return self.sottostrutture.active_on(on_date).order_by('codice')
+        return self.sottostrutture.for_tree().active_on(on_date).order_by('codice_sort')
+
+    @classmethod
+    def with_has_children_annotation(cls, qs):
+        """Annota _has_children con un EXISTS: una query per tutto l'albero, non una per nodo."""
+        return qs.annotate(_has_children=Exists(
+            Struttura.objects.filter(struttura_padre=OuterRef('pk'))
+        ))
 
     @property
     def has_children(self):
+        if hasattr(self, '_has_children'):
+            return self._has_children
         return self.sottostrutture.exists()
 
+    # ---- Navigazione dell'albero
+    #
+    # Decisione (ADR): le visite di antenati/discendenti NON si fanno in Python
+    # seguendo struttura_padre (una query per livello) e non ha senso compilarle
+    # (Numba/Cython): il costo è la latenza verso il DB, non la CPU. Un sottoalbero
+    # si legge dal cammino materializzato con un LIKE per prefisso su path (come fa
+    # _update_path); dove serve lo stato "vivo" di struttura_padre (validazione)
+    # la visita passa da tree_cte(): una sola CTE ricorsiva eseguita dal DB.
+
+    @classmethod
+    def tree_cte(cls, root_pk, direction='up'):
+        """
+        Visita l'albero a partire da root_pk con un'unica CTE ricorsiva.
+        direction='up'   → la struttura e i suoi antenati;
+        direction='down' → la struttura e i suoi discendenti.
+        Ritorna una lista di tuple (id, depth, path) ordinate per profondità,
+        con path = id visitati separati da '/' (es. "7/3/1"). I nodi già nel
+        percorso non vengono rivisitati: termina anche se nei dati c'è un ciclo.
+        """
+        if direction not in ('up', 'down'):
+            raise ValueError("direction deve essere 'up' o 'down'")
+        join = 's.id = t.parent' if direction == 'up' else 's.struttura_padre_id = t.id'
+        table = connection.ops.quote_name(cls._meta.db_table)
+        sql = (
+            f"WITH RECURSIVE t(id, parent, depth, path) AS ("
+            f" SELECT id, struttura_padre_id, 0, CAST(id AS TEXT) FROM {table} WHERE id = %s"
+            f" UNION ALL"
+            f" SELECT s.id, s.struttura_padre_id, t.depth + 1, t.path || '/' || CAST(s.id AS TEXT)"
+            f" FROM {table} s JOIN t ON {join}"
+            f" WHERE ('/' || t.path || '/') NOT LIKE ('%%/' || CAST(s.id AS TEXT) || '/%%')"
+            f") SELECT id, depth, path FROM t ORDER BY depth"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [root_pk])
+            return cursor.fetchall()
+
+    @classmethod
+    def ancestor_ids(cls, pk):
+        """Insieme degli id della struttura `pk` e di tutti i suoi antenati (una query)."""
+        return {row[0] for row in cls.tree_cte(pk, 'up')}
+
     # --- VALIDAZIONE GERARCHIA ---
     def clean(self):
         super().clean()
@@ -189,25 +343,32 @@ class Struttura(models.Model):
         if self.struttura_padre_id:
             if self.pk and self.struttura_padre_id == self.pk:
                 raise ValidationError({"struttura_padre": "Una struttura non può essere padre di sé stessa."})
-            ancestor = self.struttura_padre
-            while ancestor is not None:
-                if self.pk and ancestor.pk == self.pk:
-                    raise ValidationError({"struttura_padre": "Ciclo gerarchico non consentito."})
-                ancestor = ancestor.struttura_padre
+            # un'unica query ricorsiva invece di una SELECT per ogni antenato
+            if self.pk and self.pk in Struttura.ancestor_ids(self.struttura_padre_id):
+                raise ValidationError({"struttura_padre": "Ciclo gerarchico non consentito."})
 
         # Carica (in modo sicuro) il livello della struttura e del padre
         lvl = None
         if self.livello_id:
-            # uso filter().only() per evitare eccezioni del descriptor e ridurre query
-            lvl = Livello.objects.filter(pk=self.livello_id).only('id', 'nome', 'ordine', 'can_be_root').first()
+            # di solito già in cache (assegnato dal form); il try evita eccezioni del descriptor
+            try:
+                lvl = self.livello
+            except Livello.DoesNotExist:
+                lvl = None
 
-        padre = self.struttura_padre
+        padre = None
         padre_lvl = None
-        if padre and padre.livello_id:
-            padre_lvl = Livello.objects.filter(pk=padre.livello_id).only('id', 'nome', 'ordine').first()
+        if self.struttura_padre_id:
+            # padre + livello del padre in un'unica query
+            padre = (Struttura.objects
+                        .select_related('livello')
+                        .only('id', 'livello__id', 'livello__nome', 'livello__ordine')
+                        .filter(pk=self.struttura_padre_id)
+                        .first())
+            padre_lvl = padre.livello if padre else None
 
         # 3) regola root
-        if self.struttura_padre is None:
+        if padre is None:
             # Se il livello esiste e NON può essere root → errore
             if lvl and not lvl.can_be_root:
                 raise ValidationError({"struttura_padre": "Questo livello non può stare alla radice. Seleziona un padre."})
@@ -219,13 +380,14 @@ class Struttura(models.Model):
             return
 
         # 4a) whitelist dei livelli padre (se configurata)
-        if Livello.allowed_parents.rel.through.objects.filter(from_livello_id=lvl.id).exists():
-            # Nota: per evitare join pesanti, verifichiamo la M2M via through
-            ok = Livello.allowed_parents.rel.through.objects.filter(
-                from_livello_id=lvl.id,
-                to_livello_id=padre_lvl.id
-            ).exists()
-            if not ok:
+        # Nota: per evitare join pesanti, leggiamo la M2M via through, in un'unica query
+        allowed_ids = set(
+            Livello.allowed_parents.rel.through.objects
+            .filter(from_livello_id=lvl.id)
+            .values_list('to_livello_id', flat=True)
+        )
+        if allowed_ids:
+            if padre_lvl.id not in allowed_ids:
                 raise ValidationError({
                     "struttura_padre": f"Il livello del padre '{padre_lvl.nome}' non è consentito per '{lvl.nome}'.",
                     "livello": "Seleziona un livello coerente con la gerarchia configurata."
@@ -240,53 +402,120 @@ class Struttura(models.Model):
 
     # ---- Numerazione gerarchica (codice)
 
+    def _lock_siblings(self, parent):
+        """
+        Serializza la numerazione tra salvataggi concorrenti sotto lo stesso padre:
+        blocca la riga del padre (o, per le root, le root esistenti) fino al commit.
+        Su SQLite select_for_update è ignorato: la scrittura è già serializzata.
+        """
+        if parent is not None:
+            locked = Struttura.objects.select_for_update().filter(pk=parent.pk)
+        else:
+            locked = Struttura.objects.select_for_update().filter(struttura_padre=None)
+        list(locked.values_list('pk', flat=True))
+
     def _generate_code_for_parent(self, parent):
-        """Genera il prossimo codice disponibile sotto il padre dato."""
-        parent_code = parent.codice
-        siblings = Struttura.objects.filter(struttura_padre=parent).exclude(pk=self.pk).order_by('codice')
-        if siblings.exists():
-            last_code = (siblings.last().codice or "").split('.')
-            try:
-                new_suffix = int(last_code[-1]) + 1
-            except Exception:
-                new_suffix = 1
-            return f"{parent_code}.{new_suffix}"
-        return f"{parent_code}.1"
+        """
+        Genera il prossimo codice disponibile sotto il padre dato.
+        Il massimo è calcolato in SQL sul suffisso NUMERICO ("1.10" > "1.9"),
+        considerando solo i codici nella forma "<codice padre>.<n>".
+        """
+        prefix = f"{parent.codice}."
+        last_suffix = (Struttura.objects
+                          .filter(struttura_padre=parent, codice__regex=rf'^{re.escape(prefix)}[0-9]+$')
+                          .exclude(pk=self.pk)
+                          .annotate(suffix=Cast(Substr('codice', len(prefix) + 1), IntegerField()))
+                          .aggregate(mx=Max('suffix'))['mx'])
+        return f"{prefix}{(last_suffix or 0) + 1}"
 
     def _generate_code_for_root(self):
-        """Genera il prossimo codice root disponibile."""
-        siblings = Struttura.objects.filter(struttura_padre=None).exclude(pk=self.pk).order_by('codice')
-        if siblings.exists():
+        """Genera il prossimo codice root disponibile (massimo numerico, non lessicografico)."""
+        last_code = (Struttura.objects
+                        .filter(struttura_padre=None, codice__regex=r'^[0-9]+$')
+                        .exclude(pk=self.pk)
+                        .annotate(num=Cast('codice', IntegerField()))
+                        .aggregate(mx=Max('num'))['mx'])
+        return str((last_code or 0) + 1)
+
+    def _next_code(self, parent):
+        """
+        Prossimo codice sotto `parent` (None = root) dal contatore per padre:
+        un UPDATE next_suffix = next_suffix + 1, che ne blocca la riga fino al
+        commit, invece di leggere il massimo tra i fratelli a ogni salvataggio.
+        Il contatore mancante (primo figlio, dati pregressi) parte dal massimo
+        già in uso calcolato da _generate_code_for_*.
+        """
+        key = parent.pk if parent else 0
+        counters = StrutturaCodeCounter.objects.filter(parent_id=key)
+        if counters.update(next_suffix=F('next_suffix') + 1):
+            n = counters.values_list('next_suffix', flat=True).get() - 1
+        else:
+            self._lock_siblings(parent)
+            code = self._generate_code_for_parent(parent) if parent else self._generate_code_for_root()
+            n = int(code.rsplit('.', 1)[-1])
             try:
-                return str(int(siblings.last().codice) + 1)
-            except (TypeError, ValueError):
-                return "1"
-        return "1"
+                with transaction.atomic():
+                    StrutturaCodeCounter.objects.create(parent_id=key, next_suffix=n + 1)
+            except IntegrityError:
+                return self._next_code(parent)  # creato nel frattempo da un salvataggio concorrente
+        return f"{parent.codice}.{n}" if parent else str(n)
 
     # ---- Storico assegnazioni: utilità
 
+    @staticmethod
+    def _current_assegn_attr(on_date):
+        # il prefetch vale solo per la sua data: attributo diverso per ogni data
+        return f'_current_assegn_{on_date.isoformat()}'
+
+    @classmethod
+    def with_current_assignment(cls, qs, on_date):
+        """
+        Precarica in blocco (2 query per tutto il queryset) le assegnazioni attive
+        a on_date, evitando l'N+1 di current_assignment/responsabile_on sulle
+        singole strutture. Interrogate con un'altra data tornano alla query.
+        """
+        return qs.prefetch_related(Prefetch(
+            'assegnazioni',
+            queryset=(StrutturaResponsabile.objects
+                        .active_on(on_date)
+                        .select_related('responsabile', 'responsabile__qualifica')
+                        .order_by('-data_inizio')),
+            to_attr=cls._current_assegn_attr(on_date),
+        ))
+
     def current_assignment(self, d=None):
         """Ritorna l'assegnazione attiva alla data (default: oggi)."""
-        d = d or timezone.now().date()
+        d = d or timezone.localdate()
+        cached = self.__dict__.get(self._current_assegn_attr(d))
+        if cached is not None:
+            return cached[0] if cached else None
         return (self.assegnazioni
                     .active_on(d)
                     .select_related('responsabile', 'responsabile__qualifica')
                     .order_by('-data_inizio')
                     .first())
 
-    def sync_assignment_from_fk(self, effective_date=None):
+    def sync_assignment_from_fk(self, effective_date=None, prev_resp_id=_UNSET):
         """
         Sincronizza lo STORICO con il valore corrente del FK self.responsabile.
         - Chiude l’assegnazione corrente (se diversa) al giorno precedente.
         - Crea una nuova assegnazione dal giorno 'effective_date' (default: oggi).
         - Se il FK è None, chiude solo l’assegnazione corrente.
+        Se il chiamante passa prev_resp_id (FK prima della modifica) e non è
+        cambiato nulla, esce senza interrogare il DB.
         """
-        d = effective_date or timezone.now().date()
-        new_resp = self.responsabile  # può essere None
+        new_resp_id = self.responsabile_id  # può essere None
+        if prev_resp_id is not _UNSET and prev_resp_id == new_resp_id:
+            return  # include il caso "nessun responsabile prima né dopo"
+
+        d = effective_date or timezone.localdate()
+        # gli eventuali prefetch stanno per diventare obsoleti
+        for attr in [k for k in self.__dict__ if k.startswith('_current_assegn_')]:
+            del self.__dict__[attr]
         cur = self.current_assignment(d)
 
         # Se uguale all'attuale, nulla da fare
-        if cur and new_resp and cur.responsabile_id == new_resp.id:
+        if cur and new_resp_id and cur.responsabile_id == new_resp_id:
             return
 
         # Chiudi l’assegnazione corrente (se c’è)
@@ -295,18 +524,21 @@ class Struttura(models.Model):
             if cur.data_inizio and end < cur.data_inizio:
                 end = cur.data_inizio  # evita fine < inizio
             if cur.data_fine is None or cur.data_fine != end:
+                # cur è attiva alla data d > end: il periodo si accorcia soltanto,
+                # quindi non può nascere una sovrapposizione (nessun controllo da rifare)
                 cur.data_fine = end
-                cur.full_clean()
-                cur.save()
+                cur.save(update_fields=['data_fine'])
 
         # Se c'è un nuovo responsabile, apri una nuova riga storica
-        if new_resp:
+        if new_resp_id:
             start = max(d, self.data_inizio or d)
-            StrutturaResponsabile.objects.create(
+            assegn = StrutturaResponsabile(
                 struttura=self,
-                responsabile=new_resp,
+                responsabile_id=new_resp_id,
                 data_inizio=start
             )
+            assegn.full_clean()
+            assegn.save()
 
     # ---- Storico assegnazioni: responsabile "alla data"
 
@@ -315,58 +547,155 @@ class Struttura(models.Model):
         Ritorna il Responsabile assegnato a questa struttura alla data on_date.
         1) Cerca in StrutturaResponsabile (storico).
         2) In fallback usa il FK self.responsabile se attivo a quella data.
+        Senza prefetch (with_current_assignment) è una sola query: i due candidati
+        vengono filtrati per attività e ordinati con lo storico in testa.
         """
-        assegn = (self.assegnazioni
+        if self.__dict__.get(self._current_assegn_attr(on_date)) is not None:
+            assegn = self.current_assignment(on_date)
+            if assegn:
+                r = assegn.responsabile
+                if r and r.is_active(on_date):
+                    return r
+            r_fk = self.responsabile
+            if r_fk and r_fk.is_active(on_date):
+                return r_fk
+            return None
+
+        storico = (StrutturaResponsabile.objects
+                       .filter(struttura_id=self.pk)
+                       .active_on(on_date)
+                       .order_by('-data_inizio')
+                       .values('responsabile_id')[:1])
+        return (Responsabile.objects
                     .active_on(on_date)
-                    .select_related('responsabile', 'responsabile__qualifica')
-                    .order_by('-data_inizio')
+                    .filter(Q(pk=Subquery(storico)) | Q(pk=self.responsabile_id))
+                    .annotate(_da_storico=Case(
+                        When(pk=Subquery(storico), then=Value(0)),
+                        default=Value(1),
+                        output_field=IntegerField(),
+                    ))
+                    .select_related('qualifica')
+                    .order_by('_da_storico')
                     .first())
-        if assegn:
-            r = assegn.responsabile
-            if r and r.is_active(on_date):
-                return r
 
-        r_fk = self.responsabile
-        if r_fk and r_fk.is_active(on_date):
-            return r_fk
+    # ---- Dirty-tracking di padre/responsabile (evita di rileggere la riga in save)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        loaded = dict(zip(field_names, values))
+        instance._loaded_parent_id = loaded.get('struttura_padre_id', DEFERRED)
+        instance._loaded_resp_id = loaded.get('responsabile_id', DEFERRED)
+        return instance
 
-        return None
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        if fields is None or 'struttura_padre' in fields or 'struttura_padre_id' in fields:
+            self._loaded_parent_id = self.struttura_padre_id
+        if fields is None or 'responsabile' in fields or 'responsabile_id' in fields:
+            self._loaded_resp_id = self.responsabile_id
+
+    # ---- Ricerca
+
+    def build_search_text(self):
+        """Valore di search_text; legge livello e responsabile (usare select_related in blocco)."""
+        parts = [self.codice, self.nome]
+        if self.livello_id:
+            parts.append(self.livello.nome)
+        if self.responsabile_id:
+            parts += [self.responsabile.nome, self.responsabile.cognome]
+        return ' '.join(p for p in parts if p).lower()
+
+    @classmethod
+    def refresh_search_text(cls, qs):
+        """Ricalcola search_text sulle strutture di qs (es. dopo la modifica di un livello)."""
+        batch = []
+        for s in qs.select_related('livello', 'responsabile').iterator(chunk_size=1000):
+            text = s.build_search_text()
+            if text != s.search_text:
+                s.search_text = text
+                batch.append(s)
+        cls.objects.bulk_update(batch, ['search_text'], batch_size=1000)
+
+    def _update_path(self):
+        """
+        Ricalcola path/depth di questa struttura e, se il cammino è cambiato,
+        li riporta su tutto il sottoalbero con un solo UPDATE (LIKE per prefisso).
+        """
+        old_path, old_depth = self.path, self.depth
+        parent = None
+        if self.struttura_padre_id:
+            parent = (Struttura.objects.filter(pk=self.struttura_padre_id)
+                          .values_list('path', 'depth').first())
+        if parent:
+            self.path, self.depth = f'{parent[0]}/{self.pk}', parent[1] + 1
+        else:
+            self.path, self.depth = str(self.pk), 0
+        if (self.path, self.depth) == (old_path, old_depth):
+            return
+        Struttura.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+        if old_path:
+            Struttura.objects.filter(path__startswith=f'{old_path}/').update(
+                path=Concat(Value(self.path), Substr('path', len(old_path) + 1)),
+                depth=F('depth') + (self.depth - old_depth),
+            )
 
     def save(self, *args, **kwargs):
         # Capire se il padre o il responsabile sono cambiati
-        parent_changed = False
-        resp_changed = False
-        old_parent_id = None
-        prev_resp_id = None
-
         was_adding = self._state.adding  # True se è una nuova istanza
 
-        if self.pk:
-            try:
-                old = Struttura.objects.get(pk=self.pk)
-                old_parent_id = old.struttura_padre_id
-                prev_resp_id = old.responsabile_id
-            except Struttura.DoesNotExist:
-                old_parent_id = None
-                prev_resp_id = None
+        old_parent_id = getattr(self, '_loaded_parent_id', DEFERRED)
+        prev_resp_id = getattr(self, '_loaded_resp_id', DEFERRED)
+        if DEFERRED in (old_parent_id, prev_resp_id):
+            # istanza mai letta dal DB o caricata con quei campi differiti (only/defer):
+            # solo qui serve rileggere i valori originali, e solo se ha già una pk
+            old = None
+            if self.pk:
+                old = (Struttura.objects.filter(pk=self.pk)
+                          .values_list('struttura_padre_id', 'responsabile_id')
+                          .first())
+            old_parent_id, prev_resp_id = old or (None, None)
 
         new_parent_id = self.struttura_padre_id
         parent_changed = (old_parent_id != new_parent_id)
         resp_changed = (prev_resp_id != self.responsabile_id)
 
-        # Calcola/ricalcola il codice SOLO se manca o cambia il padre
-        if not self.codice or parent_changed:
-            if self.struttura_padre:
-                self.codice = self._generate_code_for_parent(self.struttura_padre)
-            else:
-                self.codice = self._generate_code_for_root()
+        with transaction.atomic():
+            # Calcola/ricalcola il codice SOLO se manca o cambia il padre
+            if not self.codice or parent_changed:
+                self.codice = self._next_code(self.struttura_padre)
+            self.codice_sort = codice_sort_key(self.codice)
+            self.search_text = self.build_search_text()
+
+            # Salva la struttura (serve l'ID per creare assegnazioni)
+            super().save(*args, **kwargs)
 
-        # Salva la struttura (serve l'ID per creare assegnazioni)
-        super().save(*args, **kwargs)
+            # path/depth dipendono dal pk: si aggiornano dopo l'INSERT
+            if was_adding or parent_changed or not self.path:
+                self._update_path()
+        self._loaded_parent_id = self.struttura_padre_id
+        self._loaded_resp_id = self.responsabile_id
 
-        # Sincronizza lo storico se nuova struttura con FK o se il FK è cambiato
-        if was_adding or resp_changed:
-            self.sync_assignment_from_fk(effective_date=timezone.now().date())
+        # Sincronizza lo storico se nuova struttura con FK o se il FK è cambiato.
+        # Una struttura nuova non ha storico: senza responsabile non c'è nulla da fare.
+        if (self.responsabile_id if was_adding else resp_changed):
+            self.sync_assignment_from_fk(effective_date=timezone.localdate(), prev_resp_id=prev_resp_id)
+
+
+class StrutturaCodeCounter(models.Model):
+    """
+    Prossimo suffisso numerico del codice per ogni padre (vedi Struttura._next_code).
+    parent_id è la pk del padre, 0 per le root: niente FK perché le root non hanno padre.
+    """
+    parent_id = models.PositiveIntegerField(primary_key=True)
+    next_suffix = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        verbose_name = "Contatore codici"
+        verbose_name_plural = "Contatori codici"
+
+    def __str__(self):
+        return f"{self.parent_id or 'root'} → {self.next_suffix}"
 
 
 # =========================
@@ -375,13 +704,19 @@ class Struttura(models.Model):
 
 class StrutturaResponsabileQuerySet(models.QuerySet):
     def active_on(self, on_date):
-        return self.filter(
-            Q(data_inizio__isnull=True) | Q(data_inizio__lte=on_date),
-            Q(data_fine__isnull=True)   | Q(data_fine__gte=on_date),
-        )
+        return self.filter(active_q(on_date))
 
 
 class StrutturaResponsabile(models.Model):
+    """
+    Riga dello storico. La validazione (date + sovrapposizioni, vedi clean) non è
+    ripetuta in save(): la eseguono i form/admin tramite full_clean() e
+    sync_assignment_from_fk sulle righe che apre; bulk_create e gli update
+    diretti restano a carico del chiamante.
+    Su PostgreSQL le sovrapposizioni sono comunque escluse dal DB (vincolo
+    no_overlap_periodo, migrazione 0024 → IntegrityError): lì clean() serve solo
+    a dare un messaggio leggibile nei form.
+    """
     struttura = models.ForeignKey('Struttura', on_delete=models.CASCADE, related_name='assegnazioni')
     responsabile = models.ForeignKey('Responsabile', on_delete=models.CASCADE, related_name='assegnazioni')
     data_inizio = models.DateField(default=timezone.now)
@@ -396,6 +731,11 @@ class StrutturaResponsabile(models.Model):
         indexes = [
             models.Index(fields=['struttura', 'data_inizio', 'data_fine']),
             models.Index(fields=['responsabile', 'data_inizio', 'data_fine']),
+            # indici parziali per active_on: assegnazioni aperte / chiuse
+            models.Index(fields=['struttura', 'data_inizio'], condition=Q(data_fine__isnull=True),
+                         name='assegn_open_idx'),
+            models.Index(fields=['struttura', 'data_fine'], condition=Q(data_fine__isnull=False),
+                         name='assegn_closed_idx'),
         ]
 
     def __str__(self):
@@ -403,7 +743,7 @@ class StrutturaResponsabile(models.Model):
         return f"{self.struttura} ← {self.responsabile} [{self.data_inizio} – {fino}]"
 
     def is_active(self, d=None):
-        d = d or timezone.now().date()
+        d = d or timezone.localdate()
         return ((self.data_inizio is None or self.data_inizio <= d) and
                 (self.data_fine   is None or self.data_fine   >= d))
 
@@ -416,18 +756,16 @@ class StrutturaResponsabile(models.Model):
         if not getattr(self, 'struttura_id', None):
             return
 
-        a0 = self.data_inizio
-        a1 = self.data_fine or date(9999, 12, 31)  # "infinito"
+        a0, a1 = self.data_inizio, self.data_fine  # a1 None = periodo aperto
 
-        # no sovrapposizioni per la stessa struttura
-        qs = StrutturaResponsabile.objects.filter(struttura=self.struttura).exclude(pk=self.pk)
-        overlap = qs.filter(
-            Q(data_inizio__lte=a1) &
-            (Q(data_fine__isnull=True) | Q(data_fine__gte=a0))
-        ).exists()
+        # no sovrapposizioni per la stessa struttura: estremi NULL = illimitati,
+        # quindi il lato corrispondente del confronto semplicemente non c'è
+        qs = StrutturaResponsabile.objects.filter(struttura_id=self.struttura_id).exclude(pk=self.pk)
+        if a1 is not None:
+            qs = qs.filter(data_inizio__lte=a1)
+        if a0 is not None:
+            qs = qs.filter(Q(data_fine__isnull=True) | Q(data_fine__gte=a0))
+        overlap = qs.exists()
         if overlap:
             raise ValidationError("Esiste già un'assegnazione sovrapposta per questa struttura.")
 
-    def save(self, *args, **kwargs):
-        self.full_clean()
-        return super().save(*args, **kwargs)
@@ -0,0 +1,67 @@
+from django.contrib.auth.models import Group, Permission, User
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+
+from .backends import bump_perms_version
+from .models import Livello, Qualifica, Responsabile, Struttura, StrutturaResponsabile
+from .tree_cache import bump_tree_version
+
+# modelli i cui dati compaiono nell'albero dell'organigramma
+TREE_MODELS = (Struttura, StrutturaResponsabile, Responsabile, Livello, Qualifica)
+
+
+def invalidate_tree_cache(sender, **kwargs):
+    # NB: queryset.update()/bulk_create non inviano segnali: chi li usa sui
+    # TREE_MODELS deve chiamare bump_tree_version() da sé.
+    # Dopo il commit: con la nuova versione già visibile, una GET concorrente
+    # rileggerebbe i dati non ancora committati e li metterebbe in cache per un'ora
+    transaction.on_commit(bump_tree_version)
+
+
+def refresh_strutture_search_text(sender, instance, **kwargs):
+    # nome del livello/responsabile copiato in Struttura.search_text
+    if sender is Livello:
+        Struttura.refresh_search_text(Struttura.objects.filter(livello=instance))
+    else:
+        Struttura.refresh_search_text(Struttura.objects.filter(responsabile=instance))
+
+
+for model in TREE_MODELS:
+    post_save.connect(invalidate_tree_cache, sender=model, dispatch_uid=f'tree_cache_save_{model.__name__}')
+    post_delete.connect(invalidate_tree_cache, sender=model, dispatch_uid=f'tree_cache_delete_{model.__name__}')
+
+def remember_strutture_of_responsabile(sender, instance, **kwargs):
+    # la delete mette Struttura.responsabile a NULL con un UPDATE in blocco, senza
+    # save(): le strutture coinvolte vanno lette prima che il legame sparisca
+    instance._search_text_strutture = list(instance.strutture.values_list('pk', flat=True))
+
+
+def refresh_search_text_after_delete(sender, instance, **kwargs):
+    pks = getattr(instance, '_search_text_strutture', None)
+    if pks:
+        Struttura.refresh_search_text(Struttura.objects.filter(pk__in=pks))
+
+
+for model in (Livello, Responsabile):
+    post_save.connect(refresh_strutture_search_text, sender=model, dispatch_uid=f'search_text_{model.__name__}')
+
+# (Livello ha on_delete=CASCADE: le sue strutture spariscono con lui)
+pre_delete.connect(remember_strutture_of_responsabile, sender=Responsabile, dispatch_uid='search_text_pre_delete_Responsabile')
+post_delete.connect(refresh_search_text_after_delete, sender=Responsabile, dispatch_uid='search_text_delete_Responsabile')
+
+
+def invalidate_perms_cache(sender, update_fields=None, **kwargs):
+    # cambia un utente (is_active/is_superuser), un gruppo o un'assegnazione di permessi.
+    # NB: bulk_create non invia segnali: chi lo usa su questi modelli (setup_roles)
+    # deve chiamare bump_perms_version() da sé
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return  # update_last_login a ogni login: i permessi non cambiano
+    transaction.on_commit(bump_perms_version)  # come per l'albero: dopo il commit
+
+
+for model in (User, Group, Permission):
+    post_save.connect(invalidate_perms_cache, sender=model, dispatch_uid=f'perms_save_{model.__name__}')
+    post_delete.connect(invalidate_perms_cache, sender=model, dispatch_uid=f'perms_delete_{model.__name__}')
+
+for through in (User.groups.through, User.user_permissions.through, Group.permissions.through):
+    m2m_changed.connect(invalidate_perms_cache, sender=through, dispatch_uid=f'perms_m2m_{through.__name__}')
@@ -0,0 +1,48 @@
+"""
+Cache dell'albero dell'organigramma per data (vedi visualizza_organigramma).
+
+Le chiavi contengono una "versione" globale che i segnali in signals.py
+rinnovano a ogni modifica dei modelli che finiscono nel payload: invalidare
+vuol dire solo cambiare versione (niente delete per pattern); le voci vecchie
+scadono da sole. La versione deve stare in una cache condivisa fra i processi
+(settings.CACHES): con una LocMemCache per worker la modifica invaliderebbe
+solo il processo che l'ha ricevuta.
+"""
+import hashlib
+import time
+from datetime import datetime, timezone
+
+from django.core.cache import cache
+
+TREE_CACHE_TIMEOUT = 3600
+_VERSION_KEY = 'organigramma:tree:version'
+
+
+def tree_version():
+    version = cache.get(_VERSION_KEY)
+    if version is None:
+        version = bump_tree_version()
+    return version
+
+
+def bump_tree_version():
+    # valore sempre nuovo (non un contatore): sopravvive a evizioni e riavvii della cache
+    version = str(time.time_ns())
+    cache.set(_VERSION_KEY, version, None)
+    return version
+
+
+def tree_cache_key(on_date, version):
+    return f'organigramma:tree:{version}:{on_date.isoformat()}'
+
+
+def tree_etag(on_date, version, user_pk=None, perms_version=None):
+    # la pagina include la navbar dell'utente (gruppo, voci secondo i permessi):
+    # l'ETag vale per (data, versione, utente, versione dei permessi)
+    raw = f'{on_date.isoformat()}:{version}:{user_pk or ""}:{perms_version or ""}'
+    return '"%s"' % hashlib.sha1(raw.encode()).hexdigest()
+
+
+def tree_last_modified(version):
+    # la versione è il time_ns dell'ultima modifica (o del primo accesso dopo un'evizione)
+    return datetime.fromtimestamp(int(version) // 10**9, tz=timezone.utc)
@@ -1,21 +1,41 @@
 # organigramma/views.py
-from datetime import datetime
-import json
+from collections import defaultdict
+from datetime import date, datetime, time
+from functools import reduce
+from itertools import islice
+import operator
 import csv
+import tempfile
 import openpyxl
+import orjson
 
 from django.shortcuts import render
 from django.urls import reverse, reverse_lazy
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView, TemplateView
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
-from django.http import HttpResponse, JsonResponse
+from django.http import (
+    FileResponse, HttpResponse, HttpResponseBadRequest, HttpResponseNotModified,
+    StreamingHttpResponse,
+)
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+from django.utils.http import http_date, parse_http_date_safe
 from django.utils import timezone
 from django.db.models import Q
 from django.contrib import messages
+from django.contrib.messages import get_messages
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 
 from .models import Struttura, Responsabile, Qualifica
+from .backends import perms_version
+from .tree_cache import (
+    TREE_CACHE_TIMEOUT, tree_cache_key, tree_etag, tree_last_modified, tree_version,
+)
 from .forms import StrutturaForm, ResponsabileForm, QualificaForm
 from django.contrib.auth.decorators import login_required, permission_required
 # organigramma/views.py
@@ -33,12 +53,44 @@ from django.db.models import Q
 from django.urls import reverse_lazy
 from .forms import CreateUserForm, UserUpdateForm
 
+# Paginazione: senza filtri, su PostgreSQL il totale è la stima di pg_class
+class ApproxPaginator(Paginator):
+    """
+    Paginator che evita il COUNT(*) sugli elenchi NON filtrati di tabelle grandi
+    (PostgreSQL: reltuples, aggiornato da ANALYZE/autovacuum). Con filtri, su
+    tabelle piccole o su altri DB conta esattamente. La stima può sbagliare di
+    qualche riga: l'ultima pagina può risultare vuota o non raggiungibile.
+    """
+    APPROX_MIN_ROWS = 10000  # sotto questa soglia il COUNT esatto costa poco
+
+    @cached_property
+    def count(self):
+        qs = self.object_list
+        if not isinstance(qs, QuerySet) or qs.query.where:
+            return super().count
+        conn = connections[qs.db]  # l'alias del queryset, non per forza 'default'
+        if conn.vendor == 'postgresql':
+            with conn.cursor() as cursor:
+                # solo lo schema corrente: una tabella omonima in un altro schema
+                # ha le sue statistiche
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class"
+                    " WHERE relname = %s AND relnamespace = current_schema()::regnamespace",
+                    [qs.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= self.APPROX_MIN_ROWS:
+                return row[0]
+        return super().count
+
+
 # Lista
 class UserListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
     model = User
     template_name = 'organigramma/user_list.html'
     context_object_name = 'users'
     paginate_by = 15
+    paginator_class = ApproxPaginator
     permission_required = 'auth.view_user'
     raise_exception = False
 
@@ -65,6 +117,7 @@ class UserCreateView(LoginRequiredMixin, PermissionRequiredMixin, CreateView):
 # Modifica (con feedback)
 class UserUpdateView(LoginRequiredMixin, PermissionRequiredMixin, UpdateView):
     model = User
+    queryset = User.objects.prefetch_related('groups')
     form_class = UserUpdateForm
     template_name = 'organigramma/user_update.html'
     success_url = reverse_lazy('user_list')
@@ -78,13 +131,24 @@ class UserUpdateView(LoginRequiredMixin, PermissionRequiredMixin, UpdateView):
 
 # ---------------- Helpers ----------------
 
+class OrjsonResponse(HttpResponse):
+    """Come JsonResponse (anche per liste), ma serializzato con orjson."""
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS), **kwargs)
+
+
 def _parse_on_date(request):
-    """Estrae ?on=YYYY-MM-DD, default oggi."""
-    on = request.GET.get("on")
-    try:
-        return datetime.strptime(on, "%Y-%m-%d").date() if on else timezone.now().date()
-    except Exception:
-        return timezone.now().date()
+    """Estrae ?on=YYYY-MM-DD, default oggi (data locale). Calcolata una volta per richiesta."""
+    on_date = getattr(request, '_on_date', None)
+    if on_date is None:
+        on = request.GET.get("on")
+        try:
+            on_date = date.fromisoformat(on) if on else timezone.localdate()
+        except ValueError:
+            on_date = timezone.localdate()
+        request._on_date = on_date
+    return on_date
 
 
 def _responsabile_info_attivo(responsabile, on_date):
@@ -95,6 +159,46 @@ def _responsabile_info_attivo(responsabile, on_date):
     return responsabile.nome, responsabile.cognome, qualifica
 
 
+# Colonne lette da struttura_list.html (codice, nome, url, livello, nome e
+# cognome del responsabile, date): il resto di Struttura e delle tabelle in
+# join non viene caricato.
+STRUTTURA_LIST_FIELDS = (
+    'id', 'codice', 'nome', 'url', 'data_inizio', 'data_fine',
+    'livello__nome',
+    'responsabile__nome', 'responsabile__cognome',
+)
+
+
+def _active_struttura_qs(on_date):
+    """
+    Strutture attive alla data per le viste ad albero, tutti i livelli in una
+    query (+ una per lo storico alla data): figli e assegnazioni si leggono
+    in memoria, senza active_children/responsabile_on che interrogano il DB.
+    """
+    return Struttura.with_current_assignment(
+        Struttura.objects.for_tree().active_on(on_date)
+        .select_related("responsabile__qualifica")
+        .order_by("codice_sort"),
+        on_date,
+    )
+
+
+def _build_tree(items):
+    """
+    Albero in un solo passaggio su un elenco piatto (già ordinato) di triple
+    (pk, pk_padre, nodo senza figli): qui si aggancia "children".
+    Restano fuori, come nella visita ricorsiva, i nodi sotto un padre non presente.
+    """
+    by_parent = defaultdict(list)
+    nodes = []
+    for pk, parent_pk, node in items:
+        by_parent[parent_pk].append(node)
+        nodes.append((pk, node))
+    for pk, node in nodes:
+        node["children"] = by_parent.get(pk, [])
+    return by_parent.get(None, [])
+
+
 # ---------------- Home / Dashboard ----------------
 
 class PublicHomeView(TemplateView):
@@ -115,11 +219,8 @@ def admin_dashboard(request):
 
 # ---------------- Organigramma (produzione) ----------------
 
-def visualizza_organigramma(request):
-    """
-    Costruisce l'albero partendo dalle root (padre NULL) attive alla data.
-    """
-    on_date = _parse_on_date(request)
+def _build_organigramma_data(on_date):
+    """Albero (lista di root con "children") delle strutture attive alla data."""
 
     def to_dict(s: Struttura):
         r = s.responsabile_on(on_date)  # storico
@@ -137,37 +238,54 @@ def visualizza_organigramma(request):
             "responsabile_nome": rn,
             "responsabile_cognome": rc,
             "qualifica": rq,
-            "children": [to_dict(c) for c in s.active_children(on_date)],
         }
 
-    roots_qs = (
-        Struttura.objects.active_on(on_date)
-        .filter(struttura_padre__isnull=True)
-        .select_related("livello")
-        .prefetch_related(
-            "assegnazioni",
-            "assegnazioni__responsabile",
-            "assegnazioni__responsabile__qualifica",
-            "sottostrutture",
-            "sottostrutture__assegnazioni",
-            "sottostrutture__assegnazioni__responsabile",
-            "sottostrutture__assegnazioni__responsabile__qualifica",
-        )
-        .order_by("codice")
+    return _build_tree(
+        (s.id, s.struttura_padre_id, to_dict(s)) for s in _active_struttura_qs(on_date)
     )
 
-    data = [to_dict(s) for s in roots_qs]
 
-    return render(
+def visualizza_organigramma(request):
+    """
+    Costruisce l'albero partendo dalle root (padre NULL) attive alla data.
+    L'albero è in cache per data (invalidata dai segnali, vedi tree_cache) e la
+    pagina ha un ETag (anche sui permessi, per la navbar): se il browser ha già la
+    versione corrente e non ci sono messaggi da mostrare risponde 304.
+    """
+    on_date = _parse_on_date(request)
+    version = tree_version()
+    etag = tree_etag(on_date, version, request.user.pk, perms_version())
+    # con messaggi in coda la pagina va renderizzata (base.html li mostra e li consuma)
+    if etag in request.headers.get('If-None-Match', '') and not len(get_messages(request)):
+        not_modified = HttpResponseNotModified()
+        not_modified['ETag'] = etag
+        return not_modified
+
+    cache_key = tree_cache_key(on_date, version)
+    data = cache.get(cache_key)
+    if data is None:
+        data = _build_organigramma_data(on_date)
+        cache.set(cache_key, data, TREE_CACHE_TIMEOUT)
+
+    response = render(
         request,
         "organigramma/visualizza_organigramma.html",
         {"data": data, "on_date": on_date.isoformat()},
     )
+    response['ETag'] = etag
+    return response
 
 
 # ---------------- Simulatore ----------------
 # Se preferisci la CBV, lascia questa; in alternativa puoi mantenere la FBV più sotto.
 
+# colonne di data_json del simulatore: {"cols": [...], "rows": [[...]], "parent": [id padre | null]}
+SIMULATORE_COLS = (
+    "id", "codice", "nome", "url", "livello", "livello_ordine", "can_be_root",
+    "responsabile_id", "responsabile_nome", "responsabile_cognome", "qualifica",
+)
+
+
 class SimulatoreView(LoginRequiredMixin, PermissionRequiredMixin, TemplateView):
     """
     Pagina di simulazione: richiede il permesso 'organigramma.view_simulatore'.
@@ -181,55 +299,46 @@ class SimulatoreView(LoginRequiredMixin, PermissionRequiredMixin, TemplateView):
         ctx = super().get_context_data(**kwargs)
         on_date = _parse_on_date(self.request)
 
-        def to_dict(s: Struttura):
+        def to_row(s: Struttura):
+            # stesso ordine di SIMULATORE_COLS
             r = s.responsabile_on(on_date)
-            return {
-                "id": s.id,
-                "codice": s.codice,
-                "nome": s.nome,
-                "url": s.url,
-                "livello": s.livello.nome if s.livello else "",
-                "livello_ordine": s.livello.ordine if s.livello else 99,
-                "can_be_root": bool(s.livello.can_be_root) if s.livello else True,
-                "responsabile_id": r.id if r else None,
-                "responsabile_nome": r.nome if r else "",
-                "responsabile_cognome": r.cognome if r else "",
-                "qualifica": (r.qualifica.titolo if r and r.qualifica else ("Vacante" if r is None else "")),
-                "children": [to_dict(c) for c in s.active_children(on_date)],
-            }
-
-        roots_qs = (
-            Struttura.objects.active_on(on_date)
-            .filter(struttura_padre__isnull=True)
-            .select_related("livello")
-            .prefetch_related(
-                "assegnazioni", "assegnazioni__responsabile", "assegnazioni__responsabile__qualifica",
-                "sottostrutture", "sottostrutture__livello",
-                "sottostrutture__assegnazioni",
-                "sottostrutture__assegnazioni__responsabile",
-                "sottostrutture__assegnazioni__responsabile__qualifica",
-            )
-            .order_by("codice")
-        )
-        data = [to_dict(s) for s in roots_qs]
-
-        resp_qs = (
+            return [
+                s.id,
+                s.codice,
+                s.nome,
+                s.url,
+                s.livello.nome if s.livello else "",
+                s.livello.ordine if s.livello else 99,
+                bool(s.livello.can_be_root) if s.livello else True,
+                r.id if r else None,
+                r.nome if r else "",
+                r.cognome if r else "",
+                (r.qualifica.titolo if r and r.qualifica else ("Vacante" if r is None else "")),
+            ]
+
+        strutture = _active_struttura_qs(on_date)
+        # payload colonnare: nomi dei campi una volta sola, l'albero lo ricostruisce il JS
+        rows, parent = [], []
+        for s in strutture:
+            rows.append(to_row(s))
+            parent.append(s.struttura_padre_id)
+        data = {"cols": SIMULATORE_COLS, "rows": rows, "parent": parent}
+
+        # tuple (values_list): per la tendina bastano id ed etichetta, niente istanze
+        resp_rows = (
             Responsabile.objects.active_on(on_date)
-            .select_related("qualifica")
             .order_by("cognome", "nome")
+            .values_list("id", "cognome", "nome", "qualifica__titolo")
         )
         resp_choices = [
-            {
-                "id": r.id,
-                "label": f"{r.cognome} {r.nome}" + (f" – {r.qualifica.titolo}" if r.qualifica else "")
-            }
-            for r in resp_qs
+            {"id": pk, "label": f"{cognome} {nome}" + (f" – {titolo}" if titolo is not None else "")}
+            for pk, cognome, nome, titolo in resp_rows
         ]
 
         ctx.update({
             "on_date": on_date.isoformat(),
-            "data_json": json.dumps(data, ensure_ascii=False),
-            "resp_choices_json": json.dumps(resp_choices, ensure_ascii=False),
+            "data_json": orjson.dumps(data).decode(),
+            "resp_choices_json": orjson.dumps(resp_choices).decode(),
         })
         return ctx
 
@@ -246,34 +355,101 @@ def simula_organigramma(request):
 
 @login_required
 def get_strutture_json(request):
+    """
+    Albero {id, codice, nome, children} alla data, interrogato a polling dal
+    drag&drop. ETag e Last-Modified vengono dalla versione dell'albero (vedi
+    tree_cache): se il client ha già i dati correnti, 304 senza query.
+    """
     on_date = _parse_on_date(request)
+    version = tree_version()
+    etag = tree_etag(on_date, version)
+    # senza ?on= la data è "oggi": a mezzanotte i dati cambiano anche senza modifiche
+    midnight = timezone.make_aware(datetime.combine(timezone.localdate(), time.min))
+    last_modified = int(max(tree_last_modified(version), midnight).timestamp())
+
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        not_modified = etag in if_none_match
+    else:
+        since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+        not_modified = since is not None and since >= last_modified
+    if not_modified:
+        response = HttpResponseNotModified()
+    else:
+        # tuple piatte: solo le quattro colonne servite, nessuna istanza di modello
+        rows = (
+            Struttura.objects.active_on(on_date)
+            .order_by('codice_sort')
+            .values_list('id', 'codice', 'nome', 'struttura_padre_id')
+        )
+        response = OrjsonResponse(_build_tree(
+            (pk, padre_id, {'id': pk, 'codice': codice, 'nome': nome})
+            for pk, codice, nome, padre_id in rows
+        ))
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # dati dell'utente loggato: niente cache condivise, e il browser rivalida sempre
+    response['Cache-Control'] = 'private, no-cache'
+    return response
 
-    def to_dict(s):
-        return {
-            'id': s.id,
-            'codice': s.codice,
-            'nome': s.nome,
-            'children': [to_dict(c) for c in s.active_children(on_date)]
-        }
 
-    roots = (
-        Struttura.objects.active_on(on_date)
-        .filter(struttura_padre__isnull=True)
-        .order_by('codice')
-    )
-    return JsonResponse([to_dict(s) for s in roots], safe=False)
+UPDATE_PADRE_MAX_BODY = 4096  # byte: il payload atteso è {"struttura_id": .., "nuovo_padre_id": ..}
+
+
+def _parse_pk(value):
+    """
+    pk da un valore JSON: intero o stringa numerica (editor_dragdrop invia i
+    data-id del DOM, che sono sempre stringhe). ValueError/TypeError altrimenti.
+    """
+    # bool è una sottoclasse di int, ma True/False non sono pk validi
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise TypeError(value)
+    return int(value)
 
 
 @csrf_exempt
 @login_required
 def update_struttura_padre(request):
     if request.method == 'POST':
-        data = json.loads(request.body)
-        s = Struttura.objects.get(id=data.get('struttura_id'))
-        s.struttura_padre_id = data.get('nuovo_padre_id')
-        s.save()
-        return JsonResponse({'success': True})
-    return JsonResponse({'error': 'Invalid request'}, status=400)
+        # content-type e dimensione prima di leggere request.body (che bufferizza tutto)
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return HttpResponseBadRequest()
+        if request.content_type != 'application/json' or length > UPDATE_PADRE_MAX_BODY:
+            return HttpResponseBadRequest()
+        try:
+            data = orjson.loads(request.body)
+        except orjson.JSONDecodeError:
+            return HttpResponseBadRequest()
+        if not isinstance(data, dict):
+            return HttpResponseBadRequest()
+        try:
+            struttura_id = _parse_pk(data.get('struttura_id'))
+            nuovo_padre_id = data.get('nuovo_padre_id')  # None = diventa root
+            if nuovo_padre_id is not None:
+                nuovo_padre_id = _parse_pk(nuovo_padre_id)
+        except (TypeError, ValueError):
+            return HttpResponseBadRequest()
+        # niente queryset.update(): save() rigenera codice/codice_sort, aggiorna
+        # path del sottoalbero e invalida la cache dell'albero. L'UPDATE però
+        # scrive solo le colonne che lo spostamento può cambiare.
+        s = (Struttura.objects.select_related('livello', 'responsabile')
+                .filter(pk=struttura_id).first())
+        if s is None:
+            return OrjsonResponse({'success': False}, status=404)
+        if nuovo_padre_id is not None and not Struttura.objects.filter(pk=nuovo_padre_id).exists():
+            return OrjsonResponse({'success': False}, status=404)
+        s.struttura_padre_id = nuovo_padre_id
+        # stesse regole del form: niente cicli (sé stessa o un discendente come
+        # padre) e livelli coerenti con la gerarchia
+        try:
+            s.clean()
+        except ValidationError as e:
+            return OrjsonResponse({'success': False, 'errors': e.messages}, status=400)
+        s.save(update_fields=['struttura_padre', 'codice', 'codice_sort', 'search_text'])
+        return OrjsonResponse({'success': True})
+    return OrjsonResponse({'error': 'Invalid request'}, status=400)
 
 
 # ---------------- Inline AJAX: crea Responsabile ----------------
@@ -286,18 +462,21 @@ def responsabile_create_inline(request):
     Ritorna JSON: {ok, id, label} oppure {ok:false, errors:{...}}
     """
     if request.method != 'POST':
-        return JsonResponse({'ok': False, 'errors': {'__all__': ['Metodo non valido']}}, status=405)
+        return OrjsonResponse({'ok': False, 'errors': {'__all__': ['Metodo non valido']}}, status=405)
 
     form = ResponsabileForm(request.POST, prefix='resp')
     if form.is_valid():
-        obj = form.save()
-        label = f"{getattr(obj, 'cognome', '')} {getattr(obj, 'nome', '')}".strip()
-        if getattr(obj, 'qualifica', None):
-            label = f"{label} – {obj.qualifica.titolo}"
-        return JsonResponse({'ok': True, 'id': obj.pk, 'label': label})
+        # etichetta dai dati già validati: la qualifica è l'istanza scelta nel form
+        cd = form.cleaned_data
+        label = f"{cd.get('cognome') or ''} {cd.get('nome') or ''}".strip()
+        if cd.get('qualifica'):
+            label = f"{label} – {cd['qualifica'].titolo}"
+        with transaction.atomic():
+            obj = form.save()
+        return OrjsonResponse({'ok': True, 'id': obj.pk, 'label': label})
 
     errors = {f: [str(e) for e in errs] for f, errs in form.errors.items()}
-    return JsonResponse({'ok': False, 'errors': errors}, status=400)
+    return OrjsonResponse({'ok': False, 'errors': errors}, status=400)
 
 
 # ---------------- CRUD Struttura ----------------
@@ -307,24 +486,21 @@ class StrutturaListView(LoginRequiredMixin, ListView):
     template_name = 'organigramma/struttura_list.html'
     context_object_name = 'strutture'
     paginate_by = 10
+    paginator_class = ApproxPaginator
 
     def get_queryset(self):
         qs = (
             super()
             .get_queryset()
-            .select_related('livello', 'responsabile', 'responsabile__qualifica')
-            .order_by('codice')
+            .select_related('livello', 'responsabile')
+            .only(*STRUTTURA_LIST_FIELDS)
+            .order_by('codice_sort')
         )
         q = self.request.GET.get('q', '').strip()
         if q:
-            for term in q.split():
-                qs = qs.filter(
-                    Q(nome__icontains=term) |
-                    Q(codice__icontains=term) |
-                    Q(livello__nome__icontains=term) |
-                    Q(responsabile__nome__icontains=term) |
-                    Q(responsabile__cognome__icontains=term)
-                )
+            # search_text contiene già codice, nome, livello e responsabile (in minuscolo);
+            # tutti i termini in un unico predicato AND
+            qs = qs.filter(reduce(operator.and_, (Q(search_text__contains=t) for t in q.lower().split())))
         return qs
 
     def get_context_data(self, **kwargs):
@@ -412,6 +588,7 @@ class ResponsabileListView(LoginRequiredMixin, ListView):
     template_name = 'organigramma/responsabile_list.html'
     context_object_name = 'responsabili'
     paginate_by = 10
+    paginator_class = ApproxPaginator
 
     def get_queryset(self):
         qs = (
@@ -422,8 +599,9 @@ class ResponsabileListView(LoginRequiredMixin, ListView):
         )
         q = self.request.GET.get('q', '').strip()
         if q:
-            for term in q.split():
-                qs = qs.filter(Q(nome__icontains=term) | Q(cognome__icontains=term))
+            qs = qs.filter(reduce(operator.and_, (
+                Q(nome__icontains=t) | Q(cognome__icontains=t) for t in q.split()
+            )))
         return qs
 
     def get_context_data(self, **kwargs):
@@ -483,66 +661,78 @@ class QualificaDeleteView(LoginRequiredMixin, DeleteView):
 
 # ---------------- Export CSV / Excel ----------------
 
+class _Echo:
+    """Pseudo-file per csv.writer: writerow() restituisce la riga invece di bufferizzarla."""
+    def write(self, value):
+        return value
+
+
+EXPORT_HEADERS = [
+    'Codice', 'Nome', 'Livello', 'Data Inizio', 'Data Fine',
+    'Resp. Nome', 'Resp. Cognome', 'Qualifica/Note'
+]
+
+
+def _iter_export_rows(on_date, size=2000):
+    """
+    Righe degli export alla data, come tuple (values_list) lette a blocchi.
+    Il responsabile effettivo (stesse regole di responsabile_on) arriva già
+    come id dalla query; nome/cognome/qualifica con una query per blocco.
+    """
+    rows = (
+        Struttura.objects.active_on(on_date)
+        .with_responsabile_on_id(on_date)
+        .order_by('codice_sort', 'pk')
+        .values_list('codice', 'nome', 'livello__nome', 'data_inizio', 'data_fine', '_resp_on_id')
+        .iterator(chunk_size=size)
+    )
+    for chunk in iter(lambda: list(islice(rows, size)), []):
+        resp = {
+            pk: (nome, cognome, qualifica or '')
+            for pk, nome, cognome, qualifica in Responsabile.objects
+            .filter(pk__in={r[5] for r in chunk if r[5] is not None})
+            .values_list('id', 'nome', 'cognome', 'qualifica__titolo')
+        }
+        for codice, nome, livello, data_inizio, data_fine, resp_id in chunk:
+            yield [
+                codice, nome, livello or '', data_inizio, data_fine,
+                *resp.get(resp_id, ('', '', 'Vacante')),
+            ]
+
+
 @login_required
 def export_csv(request):
     on_date = _parse_on_date(request)
-    qs = (
-        Struttura.objects.active_on(on_date)
-        .select_related('livello')
-        .prefetch_related('assegnazioni', 'assegnazioni__responsabile', 'assegnazioni__responsabile__qualifica')
-        .order_by('codice')
-    )
 
-    response = HttpResponse(content_type='text/csv')
+    def rows():
+        writer = csv.writer(_Echo())
+        yield writer.writerow(EXPORT_HEADERS)
+        for row in _iter_export_rows(on_date):
+            yield writer.writerow(row)
+
+    # in streaming: le righe partono man mano, senza tenere tutto il CSV in memoria
+    response = StreamingHttpResponse(rows(), content_type='text/csv')
     filename = f'strutture_{on_date.isoformat()}.csv'
     response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    writer = csv.writer(response)
-    writer.writerow([
-        'Codice', 'Nome', 'Livello', 'Data Inizio', 'Data Fine',
-        'Resp. Nome', 'Resp. Cognome', 'Qualifica/Note'
-    ])
-    for s in qs:
-        r = s.responsabile_on(on_date)
-        rn = r.nome if r else ''
-        rc = r.cognome if r else ''
-        rq = r.qualifica.titolo if r and r.qualifica else ('Vacante' if r is None else '')
-        writer.writerow([
-            s.codice, s.nome, s.livello.nome if s.livello else '',
-            s.data_inizio, s.data_fine, rn, rc, rq
-        ])
     return response
 
 
 @login_required
 def export_excel(request):
     on_date = _parse_on_date(request)
-    qs = (
-        Struttura.objects.active_on(on_date)
-        .select_related('livello')
-        .prefetch_related('assegnazioni', 'assegnazioni__responsabile', 'assegnazioni__responsabile__qualifica')
-        .order_by('codice')
-    )
 
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = f"Strutture_{on_date.isoformat()}"
-    ws.append([
-        'Codice', 'Nome', 'Livello', 'Data Inizio', 'Data Fine',
-        'Resp. Nome', 'Resp. Cognome', 'Qualifica/Note'
-    ])
-
-    for s in qs:
-        r = s.responsabile_on(on_date)
-        rn = r.nome if r else ''
-        rc = r.cognome if r else ''
-        rq = r.qualifica.titolo if r and r.qualifica else ('Vacante' if r is None else '')
-        ws.append([
-            s.codice, s.nome, s.livello.nome if s.livello else '',
-            s.data_inizio, s.data_fine, rn, rc, rq
-        ])
-
-    resp = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    filename = f'strutture_{on_date.isoformat()}.xlsx'
-    resp['Content-Disposition'] = f'attachment; filename="{filename}"'
-    wb.save(resp)
-    return resp
+    # write_only: le righe vanno nello xml man mano, senza l'albero di Cell in memoria
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(title=f"Strutture_{on_date.isoformat()}")
+    ws.append(EXPORT_HEADERS)
+    for row in _iter_export_rows(on_date):
+        ws.append(row)
+
+    # il file finito resta su disco (temporaneo, rimosso alla chiusura) e parte a blocchi
+    tmp = tempfile.TemporaryFile()
+    wb.save(tmp)
+    tmp.seek(0)
+    return FileResponse(
+        tmp, as_attachment=True, filename=f'strutture_{on_date.isoformat()}.xlsx',
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    )
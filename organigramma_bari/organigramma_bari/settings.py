@@ -94,6 +94,31 @@ DATABASES = {
 }
 
 
+# Cache condivisa fra i worker (gunicorn): albero dell'organigramma, versioni
+# per l'invalidazione (tree_cache.py) e permessi utente (backends.py). Con la
+# LocMemCache di default ogni processo avrebbe la sua copia e una modifica
+# invaliderebbe solo il worker che l'ha ricevuta.
+# Default: tabella nel DB (creata dalla migration 0030, nessuna dipendenza);
+# in alternativa es. DJANGO_CACHE_BACKEND=django.core.cache.backends.memcached.PyMemcacheCache
+# con DJANGO_CACHE_LOCATION=127.0.0.1:11211.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', 'organigramma_cache'),
+    }
+}
+
+
+# ModelBackend con i permessi utente in cache (organigramma/backends.py), solo
+# su memcached/redis: con la LocMemCache la revoca di un permesso arriverebbe
+# solo al worker che l'ha ricevuta, con la DatabaseCache ogni lettura della
+# cache è già una SELECT (e un miss aggiunge COUNT + INSERT): nessun guadagno.
+if any(name in CACHES['default']['BACKEND'].lower() for name in ('memcache', 'pylibmc', 'redis')):
+    AUTHENTICATION_BACKENDS = ['organigramma.backends.CachedPermissionBackend']
+else:
+    AUTHENTICATION_BACKENDS = ['django.contrib.auth.backends.ModelBackend']
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 